@@ -1,23 +1,89 @@
 import os
 import datetime
+import json
 import argparse
+import tempfile
+import threading
+from collections import defaultdict
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor
+import httplib2
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
-import pickle
-import pandas as pd
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
+from googleapiclient.errors import HttpError
 
-# If modifying these scopes, delete the file token.pickle.
+try:
+    # C parser for the ISO-8601 timestamps returned by the API; handles 'Z' natively
+    from ciso8601 import parse_datetime
+except ImportError:
+    def parse_datetime(timestamp):
+        return datetime.datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+
+# If modifying these scopes, delete the file token.json.
 SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
 
+# Directory where fetched events are cached between runs
+CACHE_DIR = '.cache'
+
+# Partial response mask: only the event fields the analysis and cache read
+EVENT_FIELDS = ('items(id,status,start/dateTime,end/dateTime,attendees(self,responseStatus)),'
+                'nextPageToken')
+
+# Response statuses shown in the analysis, in display order
+STATUSES = ('accepted', 'declined', 'needsAction', 'tentative')
+
+# Modern color scheme
+STATUS_COLORS = MappingProxyType({
+    'accepted': '#00B894',    # Fresh mint green
+    'declined': '#FF7675',    # Soft red
+    'needsAction': '#74B9FF', # Soft blue
+    'tentative': '#FDCB6E'    # Warm yellow
+})
+
+STATUS_NAMES = MappingProxyType({
+    'accepted': 'Accepted',
+    'declined': 'Declined',
+    'needsAction': 'Pending',
+    'tentative': 'Tentative'
+})
+
+STATUS_LABELS = tuple(STATUS_NAMES[status] for status in STATUSES)
+STATUS_COLOR_LIST = tuple(STATUS_COLORS[status] for status in STATUSES)
+
+# Working hours: from 9 AM up to (not including) 6 PM
+WORKING_HOURS_START = 9
+WORKING_HOURS_END = 18
+WORKING_HOURS_OF_DAY = frozenset(range(WORKING_HOURS_START, WORKING_HOURS_END))
+
+# Working days as datetime.weekday() numbers (0 = Monday): Sunday-Thursday
+WORKING_WEEKDAYS = frozenset({6, 0, 1, 2, 3})
+
+# Events are fetched as parallel requests over slices of the time window
+FETCH_SLICE_DAYS = 7
+FETCH_MAX_WORKERS = 8
+
+def write_file_atomically(path, data):
+    """Write str or bytes to path via a temporary file, so a crash can't leave a partial file"""
+    directory, name = os.path.split(path)
+    temp_file = tempfile.NamedTemporaryFile('wb' if isinstance(data, bytes) else 'w',
+                                            dir=directory or '.', prefix=f'{name}.',
+                                            suffix='.tmp', delete=False)
+    try:
+        with temp_file:
+            temp_file.write(data)
+        os.replace(temp_file.name, path)
+    except BaseException:
+        os.unlink(temp_file.name)
+        raise
+
 def get_calendar_service():
     creds = None
-    # The file token.pickle stores the user's access and refresh tokens
-    if os.path.exists('token.pickle'):
-        with open('token.pickle', 'rb') as token:
-            creds = pickle.load(token)
+    # The file token.json stores the user's access and refresh tokens
+    if os.path.exists('token.json'):
+        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
     
     # If there are no (valid) credentials available, let the user log in.
     if not creds or not creds.valid:
@@ -28,92 +94,207 @@ def get_calendar_service():
                 'credentials.json', SCOPES)
             creds = flow.run_local_server(port=0)
         # Save the credentials for the next run
-        with open('token.pickle', 'wb') as token:
-            pickle.dump(creds, token)
+        write_file_atomically('token.json', creds.to_json())
 
-    return build('calendar', 'v3', credentials=creds)
+    # The credentials are returned too, for the per-thread connections used when fetching
+    return build('calendar', 'v3', credentials=creds), creds
 
-def get_events(service, time_window_start, time_window_end):
-    events_result = service.events().list(
+def list_events_request(service, time_window_start, time_window_end, updated_min=None):
+    """Build the events().list request for the window"""
+    request_args = dict(
         calendarId='primary',
         timeMin=time_window_start.isoformat() + 'Z',
         timeMax=time_window_end.isoformat() + 'Z',
         singleEvents=True,
-        orderBy='startTime'
-    ).execute()
-    return events_result.get('items', [])
+        orderBy='startTime',
+        maxResults=2500,
+        fields=EVENT_FIELDS
+    )
+    if updated_min:
+        # Only events changed (or deleted) since the last fetch
+        request_args['updatedMin'] = updated_min
+    return service.events().list(**request_args)
+
+def fetch_events(service, time_window_start, time_window_end, updated_min=None, http=None):
+    """Yield all events in the window, following pagination"""
+    request = list_events_request(service, time_window_start, time_window_end, updated_min)
+    while request is not None:
+        events_result = request.execute(http=http)
+        yield from events_result.get('items', [])
+        request = service.events().list_next(request, events_result)
+
+def fetch_events_concurrently(service, creds, time_window_start, time_window_end):
+    """Fetch the window, splitting what doesn't fit in the first page into parallel time slices"""
+    first_page = list_events_request(service, time_window_start, time_window_end).execute()
+    events = {event['id']: event for event in first_page.get('items', [])}
+    if not first_page.get('nextPageToken'):
+        return events.values()
+    
+    # Pages are ordered by start time, so the rest of the window begins at the last timed start
+    rest_start = time_window_start
+    for event in reversed(first_page['items']):
+        start = event.get('start', {}).get('dateTime')
+        if start:
+            rest_start = (parse_datetime(start)
+                          .astimezone(datetime.timezone.utc)
+                          .replace(tzinfo=None))
+            break
+    
+    slices = []
+    slice_start = rest_start
+    while slice_start < time_window_end:
+        slice_end = min(slice_start + datetime.timedelta(days=FETCH_SLICE_DAYS), time_window_end)
+        slices.append((slice_start, slice_end))
+        slice_start = slice_end
+    
+    # httplib2 is not thread-safe, so every worker gets its own authorized connection
+    local = threading.local()
+    
+    def fetch_slice(window):
+        if not hasattr(local, 'http'):
+            local.http = AuthorizedHttp(creds, http=httplib2.Http())
+        # Drain the pages inside the worker so the requests run on this thread
+        return list(fetch_events(service, *window, http=local.http))
+    
+    with ThreadPoolExecutor(max_workers=FETCH_MAX_WORKERS) as executor:
+        # Events spanning a slice boundary are returned by more than one request
+        for slice_events in executor.map(fetch_slice, slices):
+            for event in slice_events:
+                events[event['id']] = event
+    return events.values()
+
+def fetch_changed_event_ids(service, updated_min):
+    """Yield the ids of all events changed or deleted since updated_min, anywhere in the calendar"""
+    # Not scoped to the window: an event moved out of it must still be evicted from the cache.
+    # singleEvents is off so a changed recurring series comes back once, as its master event.
+    request = service.events().list(
+        calendarId='primary',
+        updatedMin=updated_min,
+        maxResults=2500,
+        fields='items(id),nextPageToken'
+    )
+    while request is not None:
+        events_result = request.execute()
+        for event in events_result.get('items', []):
+            yield event['id']
+        request = service.events().list_next(request, events_result)
 
-def is_working_hours(event_start):
-    """Check if event is during working hours (9 AM - 6 PM)"""
-    hour = event_start.hour
-    return 9 <= hour < 18
+def refresh_cached_events(service, creds, cache, time_window_start, time_window_end):
+    """Bring cached events up to date with the changes made since they were fetched"""
+    events = cache['events']
+    # Evict every changed event; instance ids of a recurring series are '<series id>_<start>'
+    changed_ids = set(fetch_changed_event_ids(service, cache['updated']))
+    if not changed_ids:
+        return events
+    for event_id in list(events):
+        if event_id in changed_ids or event_id.split('_', 1)[0] in changed_ids:
+            del events[event_id]
+    # Re-add the changed events that are still in the window; deltas are small, so no slicing
+    for event in fetch_events(service, time_window_start, time_window_end,
+                              updated_min=cache['updated']):
+        if event.get('status') != 'cancelled':
+            events[event['id']] = event
+    return events
 
-def is_working_day(event_date):
-    """Check if event is on a working day (Sunday-Thursday)"""
-    return event_date.weekday() < 5
+def load_cache(cache_path):
+    """Load a cache file, or return None if it is missing, unreadable or malformed"""
+    try:
+        with open(cache_path) as cache_file:
+            cache = json.load(cache_file)
+        if isinstance(cache['updated'], str) and isinstance(cache['events'], dict):
+            return cache
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
 
-def analyze_calendar_data(events):
-    event_data = []
+def get_events(service, creds, time_window_start, time_window_end):
+    """Get events in the window, reusing the on-disk cache when available"""
+    # Keyed by account too, so signing in as someone else never reuses their events
+    account = service.calendarList().get(calendarId='primary', fields='id').execute()['id']
+    cache_path = os.path.join(
+        CACHE_DIR,
+        f"events_{account}_{time_window_start:%Y%m%d}_{time_window_end:%Y%m%d}.json"
+    )
+    # Take the timestamp before fetching so changes made mid-fetch are picked up next run
+    fetched_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
     
+    events = None
+    cache = load_cache(cache_path)
+    if cache is not None:
+        try:
+            events = refresh_cached_events(service, creds, cache,
+                                           time_window_start, time_window_end)
+        except HttpError as error:
+            # 410 updatedMinTooLongAgo: the cache is too old to refresh incrementally
+            if error.resp.status != 410:
+                raise
+    if events is None:
+        events = {event['id']: event
+                  for event in fetch_events_concurrently(service, creds,
+                                                        time_window_start, time_window_end)}
+    
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    write_file_atomically(cache_path, json.dumps({'updated': fetched_at, 'events': events}))
+    
+    return events.values()
+
+def accumulate_metrics(events, start_date, end_date):
+    import numpy as np
+    
+    # Calculate working days in the period (end date inclusive)
+    weekmask = [weekday in WORKING_WEEKDAYS for weekday in range(7)]  # Monday first
+    total_working_days = int(np.busday_count(start_date.date(),
+                                             end_date.date() + datetime.timedelta(days=1),
+                                             weekmask=weekmask))
+    working_hours_per_day = 8  # 9 AM - 5 PM
+    total_working_hours = total_working_days * working_hours_per_day
+    
+    # Stream events into per-status hour sums, one column for each working-hours bucket
+    working_sums = defaultdict(float)
+    non_working_sums = defaultdict(float)
+    # Hoisted into a local for the hot loop
+    working_hours_of_day = WORKING_HOURS_OF_DAY
     for event in events:
-        start = event['start'].get('dateTime')
+        start = event.get('start', {}).get('dateTime')
         if not start:  # Skip all-day events
             continue
             
-        start_time = datetime.datetime.fromisoformat(start.replace('Z', '+00:00'))
-        duration = (datetime.datetime.fromisoformat(event['end'].get('dateTime').replace('Z', '+00:00')) - 
+        start_time = parse_datetime(start)
+        duration = (parse_datetime(event['end'].get('dateTime')) - 
                    start_time).total_seconds() / 3600  # Convert to hours
         
-        response_status = 'Not Responded'
-        for attendee in event.get('attendees', []):
-            if attendee.get('self', False):
-                response_status = attendee.get('responseStatus', 'Not Responded')
-                break
+        response_status = next((attendee.get('responseStatus', 'Not Responded')
+                                for attendee in event.get('attendees') or ()
+                                if attendee.get('self')), 'Not Responded')
         
-        event_data.append({
-            'date': start_time.date(),
-            'start_time': start_time,
-            'duration': duration,
-            'response_status': response_status,
-            'during_working_hours': is_working_hours(start_time),
-            'during_working_days': is_working_day(start_time)
-        })
-    
-    return pd.DataFrame(event_data)
-
-def calculate_meeting_metrics(df, start_date, end_date):
-    # Calculate working days in the period
-    total_working_days = sum(1 for date in pd.date_range(start_date, end_date) 
-                            if date.weekday() < 5)
-    working_hours_per_day = 8  # 9 AM - 5 PM
-    total_working_hours = total_working_days * working_hours_per_day
+        sums = working_sums if start_time.hour in working_hours_of_day else non_working_sums
+        sums[response_status] += duration
     
     metrics = {}
-    for status in ['accepted', 'declined', 'needsAction', 'tentative']:
-        status_df = df[df['response_status'] == status]
+    for status in STATUSES:
+        working_hours = working_sums[status]
+        non_working_hours = non_working_sums[status]
         
         # Total hours in meetings
-        metrics[f'{status}_total_hours'] = status_df['duration'].sum()
+        metrics[f'{status}_total_hours'] = working_hours + non_working_hours
         
-        # Percentage of working hours
-        metrics[f'{status}_percentage'] = (metrics[f'{status}_total_hours'] / total_working_hours) * 100
+        # Percentage of working hours (0 when the period has no working days, e.g. a lone Friday)
+        if total_working_hours:
+            metrics[f'{status}_percentage'] = (metrics[f'{status}_total_hours'] / total_working_hours) * 100
+        else:
+            metrics[f'{status}_percentage'] = 0.0
         
         # Working hours vs non-working hours
-        working_hours = status_df[status_df['during_working_hours']]['duration'].sum()
-        non_working_hours = status_df[~status_df['during_working_hours']]['duration'].sum()
         metrics[f'{status}_working_hours'] = working_hours
         metrics[f'{status}_non_working_hours'] = non_working_hours
     
     return metrics
 
 def create_visualization(metrics):
-    # Modern color scheme
-    colors = {
-        'accepted': '#00B894',    # Fresh mint green
-        'declined': '#FF7675',    # Soft red
-        'needsAction': '#74B9FF', # Soft blue
-        'tentative': '#FDCB6E'    # Warm yellow
-    }
+    # Imported here so argument, auth and fetch errors don't pay for loading plotly
+    import numpy as np
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
     
     # Create figure with secondary y-axis
     fig = make_subplots(
@@ -122,49 +303,43 @@ def create_visualization(metrics):
         subplot_titles=["Meeting Time Analysis"]
     )
     
-    statuses = ['accepted', 'declined', 'needsAction', 'tentative']
-    status_names = {
-        'accepted': 'Accepted',
-        'declined': 'Declined',
-        'needsAction': 'Pending',
-        'tentative': 'Tentative'
-    }
+    # One trace per series (numpy arrays are sent to plotly.js as base64 typed arrays)
+    fig.add_trace(
+        go.Bar(
+            name="Meetings",
+            x=STATUS_LABELS,
+            y=np.array([metrics[f'{status}_total_hours'] for status in STATUSES], dtype=np.float32),
+            marker_color=STATUS_COLOR_LIST,
+            customdata=np.column_stack([
+                np.array([metrics[f'{status}_working_hours'] for status in STATUSES], dtype=np.float32),
+                np.array([metrics[f'{status}_non_working_hours'] for status in STATUSES], dtype=np.float32)
+            ]),
+            hovertemplate="<b>%{x}</b><br>" +
+                         "Total Hours: %{y:.1f}<br>" +
+                         "Working Hours: %{customdata[0]:.1f}<br>" +
+                         "Non-Working Hours: %{customdata[1]:.1f}<extra></extra>"
+        ),
+        secondary_y=False
+    )
     
-    # Add traces for each status
-    for status in statuses:
-        # Add bars for total hours
-        fig.add_trace(
-            go.Bar(
-                name=f"{status_names[status]} Meetings",
-                x=[status_names[status]],
-                y=[metrics[f'{status}_total_hours']],
-                marker_color=colors[status],
-                hovertemplate="<b>%{x}</b><br>" +
-                             "Total Hours: %{y:.1f}<br>" +
-                             f"Working Hours: {metrics[f'{status}_working_hours']:.1f}<br>" +
-                             f"Non-Working Hours: {metrics[f'{status}_non_working_hours']:.1f}<extra></extra>"
+    # Markers for percentage
+    fig.add_trace(
+        go.Scatter(
+            name="Percentage of Working Hours",
+            x=STATUS_LABELS,
+            y=np.array([metrics[f'{status}_percentage'] for status in STATUSES], dtype=np.float32),
+            mode='markers',
+            marker=dict(
+                size=20,
+                symbol='diamond',
+                color=STATUS_COLOR_LIST,
+                line=dict(color='white', width=2)
             ),
-            secondary_y=False
-        )
-        
-        # Add markers for percentage
-        fig.add_trace(
-            go.Scatter(
-                name=f"{status_names[status]} (%)",
-                x=[status_names[status]],
-                y=[metrics[f'{status}_percentage']],
-                mode='markers',
-                marker=dict(
-                    size=20,
-                    symbol='diamond',
-                    color=colors[status],
-                    line=dict(color='white', width=2)
-                ),
-                hovertemplate="<b>%{x}</b><br>" +
-                             "Percentage of Working Hours: %{y:.1f}%<extra></extra>"
-            ),
-            secondary_y=True
-        )
+            hovertemplate="<b>%{x}</b><br>" +
+                         "Percentage of Working Hours: %{y:.1f}%<extra></extra>"
+        ),
+        secondary_y=True
+    )
     
     # Update layout with modern styling
     fig.update_layout(
@@ -249,16 +424,13 @@ def main():
         return
     
     # Get Google Calendar service
-    service = get_calendar_service()
+    service, creds = get_calendar_service()
     
     # Get events
-    events = get_events(service, start_date, end_date)
-    
-    # Analyze data
-    df = analyze_calendar_data(events)
+    events = get_events(service, creds, start_date, end_date)
     
     # Calculate metrics
-    metrics = calculate_meeting_metrics(df, start_date, end_date)
+    metrics = accumulate_metrics(events, start_date, end_date)
     
     # Create and show visualization
     create_visualization(metrics)
@@ -0,0 +1,164 @@
+import datetime
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+import calendar_analyzer
+
+WINDOW_START = datetime.datetime(2024, 1, 1)
+WINDOW_END = datetime.datetime(2024, 2, 1)
+
+
+def make_event(event_id, start, end, status='confirmed'):
+    return {'id': event_id, 'status': status,
+            'start': {'dateTime': start}, 'end': {'dateTime': end}}
+
+
+class FakeRequest:
+    def __init__(self, service, kwargs):
+        self.service = service
+        self.kwargs = kwargs
+
+    def execute(self, http=None):
+        self.service.calls.append(self.kwargs)
+        if 'updatedMin' in self.kwargs and self.service.delta_error:
+            raise self.service.delta_error
+        return {'items': self.service.respond(self.kwargs)}
+
+
+class FakeEvents:
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, **kwargs):
+        return FakeRequest(self.service, kwargs)
+
+    def list_next(self, previous_request, previous_response):
+        return None
+
+
+class FakeCalendarList:
+    def get(self, **kwargs):
+        return self
+
+    def execute(self):
+        return {'id': 'me@example.com'}
+
+
+class FakeService:
+    """In-memory calendar: `calendar` is the current state, `changed` the ids updated since the cache"""
+
+    def __init__(self, events):
+        self.calendar = {event['id']: event for event in events}
+        self.changed = set()
+        self.delta_error = None
+        self.calls = []
+
+    def events(self):
+        return FakeEvents(self)
+
+    def calendarList(self):
+        return FakeCalendarList()
+
+    def respond(self, kwargs):
+        if 'timeMin' not in kwargs:
+            # Unscoped changed-id listing
+            return [{'id': event_id} for event_id in sorted(self.changed)]
+        in_window = [event for event in self.calendar.values()
+                     if event['end']['dateTime'] > kwargs['timeMin']
+                     and event['start']['dateTime'] < kwargs['timeMax']]
+        if 'updatedMin' in kwargs:
+            return [event for event in in_window
+                    if event['id'] in self.changed
+                    or event['id'].split('_', 1)[0] in self.changed]
+        return [event for event in in_window if event['status'] != 'cancelled']
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(calendar_analyzer, 'CACHE_DIR', str(tmp_path))
+    return tmp_path
+
+
+def get_event_ids(service):
+    events = calendar_analyzer.get_events(service, None, WINDOW_START, WINDOW_END)
+    return sorted(event['id'] for event in events)
+
+
+@pytest.fixture
+def service():
+    return FakeService([
+        make_event('a', '2024-01-02T10:00:00Z', '2024-01-02T11:00:00Z'),
+        make_event('b', '2024-01-03T10:00:00Z', '2024-01-03T11:00:00Z'),
+        make_event('series_20240104T100000Z', '2024-01-04T10:00:00Z', '2024-01-04T11:00:00Z'),
+        make_event('series_20240111T100000Z', '2024-01-11T10:00:00Z', '2024-01-11T11:00:00Z'),
+    ])
+
+
+def test_warm_run_without_changes_uses_cache(service):
+    cold = get_event_ids(service)
+    service.calls.clear()
+
+    assert get_event_ids(service) == cold
+    # Only the changed-id listing is sent
+    assert len(service.calls) == 1
+    assert 'timeMin' not in service.calls[0]
+
+
+def test_deleted_event_is_evicted(service):
+    get_event_ids(service)
+    service.calendar['a']['status'] = 'cancelled'
+    service.changed = {'a'}
+
+    assert get_event_ids(service) == ['b', 'series_20240104T100000Z', 'series_20240111T100000Z']
+
+
+def test_event_moved_out_of_window_is_evicted(service):
+    get_event_ids(service)
+    service.calendar['b'] = make_event('b', '2024-03-01T10:00:00Z', '2024-03-01T11:00:00Z')
+    service.changed = {'b'}
+
+    assert get_event_ids(service) == ['a', 'series_20240104T100000Z', 'series_20240111T100000Z']
+
+
+def test_changed_recurring_series_replaces_its_instances(service):
+    get_event_ids(service)
+    # The series was shortened: only its first instance remains, now with a new end
+    del service.calendar['series_20240111T100000Z']
+    service.calendar['series_20240104T100000Z']['end']['dateTime'] = '2024-01-04T12:00:00Z'
+    service.changed = {'series'}
+
+    events = {event['id']: event for event in
+              calendar_analyzer.get_events(service, None, WINDOW_START, WINDOW_END)}
+
+    assert sorted(events) == ['a', 'b', 'series_20240104T100000Z']
+    assert events['series_20240104T100000Z']['end']['dateTime'] == '2024-01-04T12:00:00Z'
+
+
+def test_expired_updated_min_falls_back_to_full_fetch(service):
+    get_event_ids(service)
+    service.calendar['c'] = make_event('c', '2024-01-05T10:00:00Z', '2024-01-05T11:00:00Z')
+    service.delta_error = HttpError(httplib2.Response({'status': 410}), b'updatedMinTooLongAgo')
+
+    assert get_event_ids(service) == ['a', 'b', 'c', 'series_20240104T100000Z',
+                                      'series_20240111T100000Z']
+
+
+def test_other_http_errors_are_raised(service):
+    get_event_ids(service)
+    service.delta_error = HttpError(httplib2.Response({'status': 500}), b'backendError')
+
+    with pytest.raises(HttpError):
+        get_event_ids(service)
+
+
+def test_corrupt_cache_falls_back_to_full_fetch(service, cache_dir):
+    get_event_ids(service)
+    for cache_file in cache_dir.iterdir():
+        cache_file.write_text('{"updated": ')
+    service.calls.clear()
+
+    assert get_event_ids(service) == ['a', 'b', 'series_20240104T100000Z',
+                                      'series_20240111T100000Z']
+    assert all('updatedMin' not in call for call in service.calls)